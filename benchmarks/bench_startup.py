@@ -0,0 +1,53 @@
+"""
+Benchmark CLI startup time by running migration.py commands that don't
+need a connection (e.g. --help) in a fresh interpreter
+
+usage: python benchmarks/bench_startup.py [--runs N]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    ["--help"],
+    ["orders", "--help"],
+    ["customers", "--help"],
+    ["products", "--help"],
+]
+
+
+def time_command(args, runs):
+    """Run migration.py with args `runs` times and return the timings in seconds."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "migration.py", *args],
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+@click.command()
+@click.option("--runs", "-r", type=click.INT, default=10, help="Runs per command")
+def main(runs):
+    """Print median and best startup time of each command."""
+    for args in COMMANDS:
+        timings = time_command(args, runs)
+        print(
+            f"{' '.join(args):<20} "
+            f"median {statistics.median(timings) * 1000:7.1f} ms  "
+            f"best {min(timings) * 1000:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,12 @@ else:
 
 class APP:
     MAX_THREADS = int(os.getenv("MAX_THREADS", 10))
+    # WooCommerce requests per minute for list and single record endpoints (0 = no limit)
+    RATE_LIMIT_LIST = int(os.getenv("RATE_LIMIT_LIST", 0))
+    RATE_LIMIT_ITEM = int(os.getenv("RATE_LIMIT_ITEM", 0))
+    RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", MAX_THREADS))
+    # file to share the rate limit budget between concurrent processes
+    RATE_LIMIT_FILE = os.getenv("RATE_LIMIT_FILE")
 
 
 class WC:
@@ -27,5 +33,31 @@ class DB:
     MONGO_URI = os.getenv("MONGO_URI")
     NAME = os.getenv("MONGO_DB")
     ORDER_COLLECTION = os.getenv("ORDER_COLLECTION", "orders")
+    LINE_ITEM_COLLECTION = os.getenv("LINE_ITEM_COLLECTION", "order_line_items")
+    REFUND_COLLECTION = os.getenv("REFUND_COLLECTION", "order_refunds")
     CUSTOMER_COLLECTION = os.getenv("CUSTOMER_COLLECTION", "vendors")
     PRODUCT_COLLECTION = os.getenv("PRODUCT_COLLECTION", "products")
+    VARIATION_COLLECTION = os.getenv("VARIATION_COLLECTION", "product_variations")
+
+
+class SINK:
+    PROFILE = os.getenv("SINK_PROFILE", "default")
+    # MongoClient options and bulk write batch size of each sink profile
+    PROFILES = {
+        "default": {
+            "batch_size": 100,
+        },
+        "backfill": {
+            "maxPoolSize": APP.MAX_THREADS,
+            "w": 1,
+            "journal": False,
+            "compressors": "zlib",
+            "batch_size": 1000,
+        },
+        "safe": {
+            "maxPoolSize": APP.MAX_THREADS,
+            "w": "majority",
+            "journal": True,
+            "batch_size": 100,
+        },
+    }
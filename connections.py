@@ -1,17 +1,91 @@
-from woocommerce import API
-from pymongo import MongoClient
-from config import WC, DB
+"""
+Connections to WooCommerce API and MongoDB database created lazily on first use
+"""
+import threading
+from config import WC, DB, APP, SINK
 
+_wcapi = None
+_db = None
+_writer = None
+_sink_profile = SINK.PROFILE
+_lock = threading.Lock()
 
-wcapi = API(
-    url=WC.STORE_URL,
-    consumer_key=WC.CONSUMER_KEY,
-    consumer_secret=WC.CONSUMER_SECRET,
-    version="wc/v3",
-    timeout=120,
-)
 
-client = MongoClient(DB.MONGO_URI)
-db = client[DB.NAME]
+def get_wcapi():
+    """Get the WooCommerce API client, creating it on first use."""
+    global _wcapi
 
-client.server_info()  # authenticate first to check for auth errors before running the script
+    if _wcapi is None:
+        with _lock:
+            if _wcapi is None:
+                from woocommerce import API
+
+                from ratelimit import TokenBucket, RateLimitedAPI
+
+                api = API(
+                    url=WC.STORE_URL,
+                    consumer_key=WC.CONSUMER_KEY,
+                    consumer_secret=WC.CONSUMER_SECRET,
+                    version="wc/v3",
+                    timeout=120,
+                )
+                buckets = {}
+                for name, rate in (
+                    ("list", APP.RATE_LIMIT_LIST),
+                    ("item", APP.RATE_LIMIT_ITEM),
+                ):
+                    if rate > 0:
+                        buckets[name] = TokenBucket(
+                            name, rate, APP.RATE_LIMIT_BURST, APP.RATE_LIMIT_FILE
+                        )
+                _wcapi = RateLimitedAPI(api, buckets.get("list"), buckets.get("item"))
+    return _wcapi
+
+
+def get_db():
+    """Get the MongoDB database, connecting on first use."""
+    global _db
+
+    if _db is None:
+        with _lock:
+            if _db is None:
+                from pymongo import MongoClient
+
+                options = dict(SINK.PROFILES[_sink_profile])
+                options.pop("batch_size")
+                client = MongoClient(DB.MONGO_URI, **options)
+                client.server_info()  # authenticate first to check for auth errors before running the script
+                _db = client[DB.NAME]
+    return _db
+
+
+def get_writer():
+    """Get the bulk writer of the selected sink profile, creating it on first use."""
+    global _writer
+
+    if _writer is None:
+        db = get_db()
+        with _lock:
+            if _writer is None:
+                from sink import BulkWriter
+
+                batch_size = SINK.PROFILES[_sink_profile]["batch_size"]
+                _writer = BulkWriter(db, batch_size)
+    return _writer
+
+
+def set_sink_profile(name):
+    """Select the sink profile, must be called before connecting to the database."""
+    global _sink_profile
+
+    if _db is not None:
+        raise Exception("Sink profile must be set before connecting to the database")
+    _sink_profile = name
+
+
+def describe_sink_profile():
+    """Describe the selected sink profile for run summaries."""
+    options = ", ".join(
+        f"{key}={value}" for key, value in SINK.PROFILES[_sink_profile].items()
+    )
+    return f"{_sink_profile} ({options})"
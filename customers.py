@@ -2,16 +2,20 @@
 Module to import all customers or specific customer from WooCommerce
 """
 import concurrent.futures
+from functools import partial
+from pymongo import ReplaceOne
 from tqdm import tqdm
 from dateutil import parser as dateparser
 from config import APP, DB
-from connections import wcapi, db
+from connections import get_wcapi, get_db, get_writer, describe_sink_profile
+from idindex import IdIndex
+from pool import bounded_as_completed, peak_memory
 
 MAX_THREADS = APP.MAX_THREADS
 max_customer_per_page = 100
 
-# list of customer ids that are in the database currently
-customers_in_db = set()
+# ids of customers that are in the database currently
+customers_in_db = IdIndex()
 
 num_of_written_records = 0
 num_of_skipped_records = 0
@@ -22,8 +26,13 @@ def get_customers_in_db(from_date, to_date):
     # Mongo friendly datetime
     from_date = dateparser.isoparse(from_date)
     to_date = dateparser.isoparse(to_date)
-    results = db[DB.CUSTOMER_COLLECTION].find(
+    collection = get_db()[DB.CUSTOMER_COLLECTION]
+    # index on id lets the sort below (and upserts by id) avoid an in-memory sort
+    collection.create_index("id")
+    results = collection.find(
         {"date_created": {"$gte": from_date, "$lte": to_date}},
+        projection={"id": 1, "_id": 0},
+        sort=[("id", 1)],
     )
     return results
 
@@ -44,33 +53,39 @@ def import_all_customers(sort, from_date, to_date, sync=False):
     if sync == True:
         # get all customers that are in the database first
         results = get_customers_in_db(from_date, to_date)
-        for order in results:
-            customers_in_db.add(order.get("id"))
+        customers_in_db.load(customer.get("id") for customer in results)
 
     print("Customers found in DB: ", len(customers_in_db))
 
     page = 1
-    initial_customers = wcapi.get(
+    initial_customers = get_wcapi().get(
         "customers",
         params={
             "per_page": max_customer_per_page,
             "page": page,
+            "order": sort,
             "role": "seller",
         },
     )
 
     total_pages = initial_customers.headers.get("X-WP-TotalPages", 0)
     print(f"Total pages: {total_pages}\n")
-    pages = range(1, int(total_pages) + 1)
+    pages = range(2, int(total_pages) + 1)
 
-    # use multi-threading to pull multiple customers concurrently
+    def tasks():
+        if int(total_pages) > 0:
+            # page 1 is already fetched, process its body instead of requesting it again
+            yield partial(
+                get_customers, 1, sort, from_date, to_date, response=initial_customers
+            )
+        for page in pages:
+            yield partial(get_customers, page, sort, from_date, to_date)
+
+    # use multi-threading to pull multiple customers concurrently, submitting pages
+    # only as workers free up so memory stays flat regardless of the number of pages
     with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        future_to_customer = {
-            executor.submit(get_customers, page, sort, from_date, to_date): page
-            for page in pages
-        }
         for future in tqdm(
-            concurrent.futures.as_completed(future_to_customer),
+            bounded_as_completed(executor, tasks(), 2 * MAX_THREADS),
             total=int(total_pages),
             unit="page",
         ):
@@ -79,41 +94,126 @@ def import_all_customers(sort, from_date, to_date, sync=False):
             except:
                 pass
 
+    # write what is left in the bulk write buffers
+    get_writer().flush()
+
     print(f'\n\n{"-" * 50}')
-    print(f"Newly inserted records: {num_of_written_records}")
-    print(f"Skipped records: {num_of_skipped_records}\n")
+    print(f"Sink profile: {describe_sink_profile()}")
+    failed = get_writer().failed_records(DB.CUSTOMER_COLLECTION)
+    print(f"Newly inserted records: {num_of_written_records - failed}")
+    print(f"Skipped records: {num_of_skipped_records}")
+    print(f"Failed writes: {failed}")
+    print(f"Peak memory: {peak_memory()}\n")
 
 
-def get_customers(page, sort, from_date, to_date):
-    """Get customers on a specific page."""
+def get_customers(page, sort, from_date, to_date, response=None):
+    """
+    Get customers on a specific page.
+
+    An already fetched `response` for the page can be passed to
+    process it without requesting the page again.
+    """
     try:
-        response = wcapi.get(
+        if response is None:
+            response = get_wcapi().get(
+                "customers",
+                params={
+                    "per_page": max_customer_per_page,
+                    "page": page,
+                    "order": sort,
+                    "role": "seller",
+                },
+            )
+        return process_customers_page(response, page, from_date, to_date)
+    except Exception as e:
+        print(f"Unexpected Error: {e}")
+    return False
+
+
+def get_customers_by_ids(ids):
+    """Get a batch of customers specified by ID with a single request."""
+    try:
+        response = get_wcapi().get(
             "customers",
             params={
+                "include": ",".join(str(id) for id in ids),
                 "per_page": max_customer_per_page,
-                "page": page,
-                "order": sort,
-                "role": "seller",
+                "role": "all",
             },
         )
-        if response.status_code != 200:
-            print(f"Error status code {response.status_code} for page {page}")
-        else:
-            customers = tuple(response.json())
-            for customer in customers:
-                process_customer(customer, from_date, to_date)
-
-            customers = None  # clear previous values to free up memory
-            return True
+        return process_customers_page(
+            response, f"with ids {ids[0]}-{ids[-1]}", None, None
+        )
     except Exception as e:
         print(f"Unexpected Error: {e}")
     return False
 
 
+def process_customers_page(response, page, from_date, to_date):
+    """Process customers on a page response and bulk write them to MongoDB database."""
+    if response.status_code != 200:
+        print(f"Error status code {response.status_code} for page {page}")
+        return False
+
+    customers = tuple(response.json())
+    for customer in customers:
+        request = process_customer(customer, from_date, to_date)
+        if request:
+            get_writer().add(DB.CUSTOMER_COLLECTION, [request])
+
+    customers = None  # clear previous values to free up memory
+    return True
+
+
+def import_customers_by_ids(ids):
+    """
+    Import customers specified by ID in batches of up to 100 per request
+
+    params:
+    ids: list of int - IDs of customers to import
+    """
+    ids = sorted(set(ids))
+    num_of_batches = -(-len(ids) // max_customer_per_page)
+    print(f"Total batches: {num_of_batches}\n")
+
+    tasks = (
+        partial(get_customers_by_ids, ids[i : i + max_customer_per_page])
+        for i in range(0, len(ids), max_customer_per_page)
+    )
+
+    # use multi-threading to pull multiple batches concurrently, submitting
+    # batches only as workers free up
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
+        for future in tqdm(
+            bounded_as_completed(executor, tasks, 2 * MAX_THREADS),
+            total=num_of_batches,
+            unit="page",
+        ):
+            try:
+                status = future.result()
+            except:
+                pass
+
+    # write what is left in the bulk write buffers
+    get_writer().flush()
+
+    print(f'\n\n{"-" * 50}')
+    print(f"Sink profile: {describe_sink_profile()}")
+    failed = get_writer().failed_records(DB.CUSTOMER_COLLECTION)
+    print(f"Newly inserted records: {num_of_written_records - failed}")
+    print(f"Skipped records: {num_of_skipped_records}")
+    print(f"Failed writes: {failed}")
+    print(f"Peak memory: {peak_memory()}\n")
+
+
 def process_customer(customer, from_date, to_date):
     """
     Process customer to convert date and times to datetime objects
     and import customers created between the specified date
+    (any date when from_date is None)
+
+    returns: write request to insert the customer to MongoDB database,
+    None when the customer is skipped
     """
     global num_of_skipped_records, num_of_written_records
 
@@ -121,7 +221,7 @@ def process_customer(customer, from_date, to_date):
         print("No customer id skipping")
         return
 
-    if from_date <= customer["date_created"] <= to_date:
+    if from_date is None or from_date <= customer["date_created"] <= to_date:
         date_fields = [
             "date_created",
             "date_created_gmt",
@@ -138,10 +238,8 @@ def process_customer(customer, from_date, to_date):
 
         customer_id = customer.get("id")
         if customer_id not in customers_in_db:
-            db[DB.CUSTOMER_COLLECTION].find_one_and_replace(
-                filter={"id": customer_id}, replacement=customer, upsert=True
-            )
             num_of_written_records += 1
+            return ReplaceOne({"id": customer_id}, customer, upsert=True)
         else:
             # print(f"Customer id: {customer_id} found in db (skipping)")
             num_of_skipped_records += 1
@@ -149,7 +247,7 @@ def process_customer(customer, from_date, to_date):
 
 def get_customer(id):
     """Get specific customer specified by ID."""
-    customer = wcapi.get(f"customers/{id}").json()
+    customer = get_wcapi().get(f"customers/{id}").json()
     if not customer.get("id", None):
         print("No customer id skipping")
         return
@@ -168,6 +266,6 @@ def get_customer(id):
             continue
         customer[field] = dateparser.isoparse(str_date)
 
-    db[DB.CUSTOMER_COLLECTION].find_one_and_replace(
+    get_db()[DB.CUSTOMER_COLLECTION].find_one_and_replace(
         filter={"id": customer.get("id")}, replacement=customer, upsert=True
     )
@@ -0,0 +1,60 @@
+"""
+Compact index of record ids used to skip records that are already in the database
+"""
+from array import array
+from bisect import bisect_left
+
+
+class IdIndex:
+    """
+    Set-like collection of integer ids stored as a sorted array of 64-bit ints.
+
+    Takes 8 bytes per id instead of a Python int object plus set slot.
+    The index is built once with `load` and only read afterwards, so
+    worker threads can check membership concurrently without locking.
+    """
+
+    def __init__(self):
+        self._ids = array("q")
+
+    def load(self, ids):
+        """
+        Build the index by streaming ids from an iterable.
+
+        Ids are expected in ascending order (e.g. a Mongo cursor sorted by id)
+        which lets them be appended directly. Unsorted input is sorted once at the end.
+        """
+        items = array("q")
+        last_id = None
+        is_sorted = True
+        for id in ids:
+            if id is None:
+                continue
+            id = int(id)
+            if last_id is not None and id <= last_id:
+                if id == last_id:
+                    continue
+                is_sorted = False
+            items.append(id)
+            last_id = id
+
+        if not is_sorted:
+            # sort the packed ids and drop the duplicates the unsorted input left
+            unique = array("q")
+            for id in sorted(items):
+                if not unique or unique[-1] != id:
+                    unique.append(id)
+            items = unique
+
+        # swap in the finished array so readers never see a partial index
+        self._ids = items
+
+    def __contains__(self, id):
+        if id is None:
+            return False
+        ids = self._ids
+        i = bisect_left(ids, id)
+        return i < len(ids) and ids[i] == id
+
+    def __len__(self):
+        return len(self._ids)
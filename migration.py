@@ -3,16 +3,42 @@ Command-line interface for the script
 """
 import click
 import datetime
-import customers, orders, products
+import connections
+from config import SINK
+
+# entity modules (orders, customers, products) are imported inside their
+# subcommand so other commands and --help don't pay for loading them
+
+
+def read_ids(ids, ids_file):
+    """Combine IDs given with --id and the ones listed in --ids-file."""
+    ids = list(ids)
+    if ids_file:
+        for line in ids_file:
+            for token in line.replace(",", " ").split():
+                try:
+                    ids.append(int(token))
+                except ValueError:
+                    raise click.BadParameter(
+                        f"{token!r} is not a valid integer ID.", param_hint="--ids-file"
+                    )
+    return ids
 
 
 @click.group()
-def cli():
+@click.option(
+    "--profile",
+    "-p",
+    type=click.Choice(list(SINK.PROFILES)),
+    help="MongoDB sink profile setting write concern, pool size and batch size",
+    default=SINK.PROFILE,
+)
+def cli(profile):
     """
     A command-line tool to migrate orders and customers from WooCommerce
     to MongoDB database.
     """
-    pass
+    connections.set_sink_profile(profile)
 
 
 @click.command("orders")
@@ -20,7 +46,13 @@ def cli():
     "--id",
     "-i",
     type=click.INT,
-    help="ID of specific order to be imported.",
+    multiple=True,
+    help="ID of specific order to be imported (can be repeated).",
+)
+@click.option(
+    "--ids-file",
+    type=click.File("r"),
+    help="File with IDs of orders to be imported (separated by newlines or commas).",
 )
 @click.option(
     "--sort",
@@ -50,13 +82,26 @@ def cli():
     help="Sync records (insert ones that are not in the Database)",
     default=False,
 )
-def import_orders(id, sort, after, before, days, hours, sync):
+@click.option(
+    "--normalize",
+    is_flag=True,
+    help="Store order line items and refunds in their own collections",
+    default=False,
+)
+def import_orders(id, ids_file, sort, after, before, days, hours, sync, normalize):
     """
     Import all orders created between a datetime range or specific order
     """
-    if id:
-        print(f"Importing specific order with ID {id}")
-        orders.get_order(id)
+    import orders
+
+    ids = read_ids(id, ids_file)
+    if len(ids) == 1:
+        print(f"Importing specific order with ID {ids[0]}")
+        orders.get_order(ids[0], normalize=normalize)
+        return
+    if ids:
+        print(f"Importing {len(ids)} orders specified by ID...\n")
+        orders.import_orders_by_ids(ids, normalize=normalize)
         return
 
     if sort:
@@ -69,7 +114,7 @@ def import_orders(id, sort, after, before, days, hours, sync):
         print(
             f"Importing all orders created after '{after}' and before '{before}' sorted '{sort}'...\n"
         )
-        orders.import_all_orders(sort, after, before)
+        orders.import_all_orders(sort, after, before, normalize=normalize)
     else:
         current_time = datetime.datetime.now()
         today = datetime.date.today()
@@ -97,9 +142,13 @@ def import_orders(id, sort, after, before, days, hours, sync):
             f"Importing all orders created after '{after}' and before '{before}' sorted '{sort}'...\n"
         )
         if sync:
-            orders.import_all_orders(sort, after, before, sync=True)
+            orders.import_all_orders(
+                sort, after, before, sync=True, normalize=normalize
+            )
         else:
-            orders.import_all_orders(sort, after, before, sync=False)
+            orders.import_all_orders(
+                sort, after, before, sync=False, normalize=normalize
+            )
 
 
 @click.command("customers")
@@ -107,7 +156,13 @@ def import_orders(id, sort, after, before, days, hours, sync):
     "--id",
     "-i",
     type=click.INT,
-    help="ID of specific customer to be imported.",
+    multiple=True,
+    help="ID of specific customer to be imported (can be repeated).",
+)
+@click.option(
+    "--ids-file",
+    type=click.File("r"),
+    help="File with IDs of customers to be imported (separated by newlines or commas).",
 )
 @click.option(
     "--sort",
@@ -137,13 +192,20 @@ def import_orders(id, sort, after, before, days, hours, sync):
     help="Sync records (insert ones that are not in the Database)",
     default=False,
 )
-def import_customers(id, sort, after, before, days, hours, sync):
+def import_customers(id, ids_file, sort, after, before, days, hours, sync):
     """
     Import all customers created between a datetime range or specific customer
     """
-    if id:
-        print(f"Importing specific customer with ID {id}...\n")
-        customers.get_customer(id)
+    import customers
+
+    ids = read_ids(id, ids_file)
+    if len(ids) == 1:
+        print(f"Importing specific customer with ID {ids[0]}...\n")
+        customers.get_customer(ids[0])
+        return
+    if ids:
+        print(f"Importing {len(ids)} customers specified by ID...\n")
+        customers.import_customers_by_ids(ids)
         return
 
     if sort:
@@ -194,7 +256,13 @@ def import_customers(id, sort, after, before, days, hours, sync):
     "--id",
     "-i",
     type=click.INT,
-    help="ID of specific product to be imported.",
+    multiple=True,
+    help="ID of specific product to be imported (can be repeated).",
+)
+@click.option(
+    "--ids-file",
+    type=click.File("r"),
+    help="File with IDs of products to be imported (separated by newlines or commas).",
 )
 @click.option(
     "--sort",
@@ -224,13 +292,29 @@ def import_customers(id, sort, after, before, days, hours, sync):
     help="Sync records (insert ones that are not in the Database)",
     default=False,
 )
-def import_products(id, sort, after, before, days, hours, sync):
+@click.option(
+    "--with-variations",
+    is_flag=True,
+    help="Also import variations of variable products",
+    default=False,
+)
+def import_products(
+    id, ids_file, sort, after, before, days, hours, sync, with_variations
+):
     """
     Import all products created between a datetime range or specific product
     """
-    if id:
-        print(f"Importing specific product with ID {id}")
-        products.get_product(id)
+    import products
+
+    ids = read_ids(id, ids_file)
+    if len(ids) == 1 and not with_variations:
+        print(f"Importing specific product with ID {ids[0]}")
+        products.get_product(ids[0])
+        return
+    if ids:
+        # the batched path also queues the variations of variable products
+        print(f"Importing {len(ids)} products specified by ID...\n")
+        products.import_products_by_ids(ids, with_variations=with_variations)
         return
 
     if sort:
@@ -243,7 +327,9 @@ def import_products(id, sort, after, before, days, hours, sync):
         print(
             f"Importing all products created after '{after}' and before '{before}' sorted '{sort}'...\n"
         )
-        products.import_all_products(sort, after, before)
+        products.import_all_products(
+            sort, after, before, with_variations=with_variations
+        )
     else:
         current_time = datetime.datetime.now()
         today = datetime.date.today()
@@ -271,14 +357,73 @@ def import_products(id, sort, after, before, days, hours, sync):
             f"Importing all products created after '{after}' and before '{before}' sorted '{sort}'...\n"
         )
         if sync:
-            products.import_all_products(sort, after, before, sync=True)
+            products.import_all_products(
+                sort, after, before, sync=True, with_variations=with_variations
+            )
         else:
-            products.import_all_products(sort, after, before, sync=False)
+            products.import_all_products(
+                sort, after, before, sync=False, with_variations=with_variations
+            )
+
+
+@click.command("verify")
+@click.argument("entity", type=click.Choice(["orders", "products"]))
+@click.option("--after", "-a", help="ISO datetime to verify records after (FROM)")
+@click.option("--before", "-b", help="ISO datetime to verify records before (TO)")
+@click.option(
+    "--days",
+    "-d",
+    type=click.INT,
+    help="Verify records created in the past X days (default=1 day)",
+    default=1,
+)
+@click.option(
+    "--buckets",
+    type=click.INT,
+    help="Number of date buckets to compare counts in (default=24)",
+    default=24,
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only report missing or stale records without re-importing them",
+    default=False,
+)
+@click.option(
+    "--normalize",
+    is_flag=True,
+    help="Re-import orders with line items and refunds in their own collections "
+    "(use when the orders were imported with orders --normalize)",
+    default=False,
+)
+def verify_records(entity, after, before, days, buckets, dry_run, normalize):
+    """
+    Compare record counts in WooCommerce and the Database per date bucket
+    and re-import only the missing or stale records
+    """
+    import verify
+
+    if not (after and before):
+        current_time = datetime.datetime.now()
+        start_time = current_time - datetime.timedelta(days=days)
+        after = f'{start_time.strftime("%Y-%m-%dT%H:%M:%S")}.000'
+        before = f'{current_time.strftime("%Y-%m-%dT%H:%M:%S")}.000'
+
+    print(f"Verifying {entity} created after '{after}' and before '{before}'...\n")
+    verify.verify(
+        entity,
+        after,
+        before,
+        buckets=buckets,
+        reimport=not dry_run,
+        normalize=normalize,
+    )
 
 
 cli.add_command(import_orders)
 cli.add_command(import_products)
 cli.add_command(import_customers)
+cli.add_command(verify_records)
 
 
 if __name__ == "__main__":
@@ -2,17 +2,21 @@
 Moudle to import all orders or specific order from WooCommerce
 """
 import concurrent.futures
+from functools import partial
 from datetime import datetime
+from pymongo import ReplaceOne, DeleteMany
 from tqdm import tqdm
 from dateutil import parser as dateparser
 from config import DB, APP
-from connections import wcapi, db
+from connections import get_wcapi, get_db, get_writer, describe_sink_profile
+from idindex import IdIndex
+from pool import bounded_as_completed, peak_memory
 
 MAX_THREADS = APP.MAX_THREADS
 max_order_per_page = 100
 
-# list of orders ids that are in the database currently
-orders_in_db = set()
+# ids of orders that are in the database currently
+orders_in_db = IdIndex()
 
 num_of_written_records = 0
 num_of_skipped_records = 0
@@ -23,13 +27,18 @@ def get_orders_in_db(from_date, to_date):
     # Mongo friendly datetime
     from_date = dateparser.isoparse(from_date)
     to_date = dateparser.isoparse(to_date)
-    results = db[DB.ORDER_COLLECTION].find(
+    collection = get_db()[DB.ORDER_COLLECTION]
+    # index on id lets the sort below (and upserts by id) avoid an in-memory sort
+    collection.create_index("id")
+    results = collection.find(
         {"date_created": {"$gte": from_date, "$lte": to_date}},
+        projection={"id": 1, "_id": 0},
+        sort=[("id", 1)],
     )
     return results
 
 
-def import_all_orders(sort, from_date, to_date, sync=False):
+def import_all_orders(sort, from_date, to_date, sync=False, normalize=False):
     """
     Import all orders between from_date and to_date
 
@@ -37,6 +46,7 @@ def import_all_orders(sort, from_date, to_date, sync=False):
     sort: str - Sort orders ascending or descending.
     from_date: str - import orders submitted starting from this date
     to_date: str - import orders submitted untill this date
+    normalize: bool - store line items and refunds in their own collections
 
     returns: list of orders
     """
@@ -45,16 +55,18 @@ def import_all_orders(sort, from_date, to_date, sync=False):
     if sync == True:
         # get all orders that are in the database first
         results = get_orders_in_db(from_date, to_date)
-        for order in results:
-            orders_in_db.add(order.get("id"))
+        orders_in_db.load(order.get("id") for order in results)
 
     print("Orders found in DB: ", len(orders_in_db))
 
+    if normalize:
+        ensure_normalized_indexes()
+
     after = datetime.fromisoformat(from_date)
     before = datetime.fromisoformat(to_date)
 
     page = 1
-    initial_orders = wcapi.get(
+    initial_orders = get_wcapi().get(
         "orders",
         params={
             "per_page": max_order_per_page,
@@ -66,16 +78,28 @@ def import_all_orders(sort, from_date, to_date, sync=False):
     )
     total_pages = initial_orders.headers.get("X-WP-TotalPages", 0)
     print(f"Total pages: {total_pages}\n")
-    pages = range(1, int(total_pages) + 1)
+    pages = range(2, int(total_pages) + 1)
+
+    def tasks():
+        if int(total_pages) > 0:
+            # page 1 is already fetched, process its body instead of requesting it again
+            yield partial(
+                get_orders,
+                1,
+                sort,
+                after,
+                before,
+                normalize=normalize,
+                response=initial_orders,
+            )
+        for page in pages:
+            yield partial(get_orders, page, sort, after, before, normalize=normalize)
 
-    # use multi-threading to pull multiple orders concurrently
+    # use multi-threading to pull multiple orders concurrently, submitting pages
+    # only as workers free up so memory stays flat regardless of the number of pages
     with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        future_to_order = {
-            executor.submit(get_orders, page, sort, after, before): page
-            for page in pages
-        }
         for future in tqdm(
-            concurrent.futures.as_completed(future_to_order),
+            bounded_as_completed(executor, tasks(), 2 * MAX_THREADS),
             total=int(total_pages),
             unit="page",
         ):
@@ -84,42 +108,129 @@ def import_all_orders(sort, from_date, to_date, sync=False):
             except:
                 pass
 
+    # write what is left in the bulk write buffers
+    get_writer().flush()
+
     print(f'\n\n{"-" * 50}')
-    print(f"Newly inserted records: {num_of_written_records}")
-    print(f"Skipped records: {num_of_skipped_records}\n")
+    print(f"Sink profile: {describe_sink_profile()}")
+    failed = get_writer().failed_records(DB.ORDER_COLLECTION)
+    print(f"Newly inserted records: {num_of_written_records - failed}")
+    print(f"Skipped records: {num_of_skipped_records}")
+    print(f"Failed writes: {failed}")
+    print(f"Peak memory: {peak_memory()}\n")
+
+
+def get_orders(page, sort, after, before, normalize=False, response=None):
+    """
+    Get orders on a specific page.
+
+    An already fetched `response` for the page can be passed to
+    process it without requesting the page again.
+    """
+    try:
+        if response is None:
+            response = get_wcapi().get(
+                "orders",
+                params={
+                    "per_page": max_order_per_page,
+                    "after": after.isoformat(),
+                    "before": before.isoformat(),
+                    "page": page,
+                    "order": sort,
+                },
+            )
+        return process_orders_page(response, page, normalize)
+    except Exception as e:
+        print(f"Unexpected Error: {e}")
+    return False
 
 
-def get_orders(page, sort, after, before):
-    """Get orders on a specific page."""
+def get_orders_by_ids(ids, normalize=False):
+    """Get a batch of orders specified by ID with a single request."""
     try:
-        response = wcapi.get(
+        response = get_wcapi().get(
             "orders",
             params={
+                "include": ",".join(str(id) for id in ids),
                 "per_page": max_order_per_page,
-                "after": after.isoformat(),
-                "before": before.isoformat(),
-                "page": page,
-                "order": sort,
             },
         )
-        if response.status_code != 200:
-            print(f"Error status code {response.status_code} for page {page}")
-        else:
-            orders = tuple(response.json())
-            for order in orders:
-                process_order(order)
-
-            orders = None  # clear previous values to free up memeory
-            return True
+        return process_orders_page(response, f"with ids {ids[0]}-{ids[-1]}", normalize)
     except Exception as e:
         print(f"Unexpected Error: {e}")
     return False
 
 
-def process_order(order):
+def process_orders_page(response, page, normalize=False):
+    """Process orders on a page response and bulk write them to MongoDB database."""
+    if response.status_code != 200:
+        print(f"Error status code {response.status_code} for page {page}")
+        return False
+
+    orders = tuple(response.json())
+    for order in orders:
+        requests = process_order(order, normalize)
+        if not requests:
+            continue
+        # line items and refunds are written in the same flush as their order
+        ops = requests.pop(DB.ORDER_COLLECTION)
+        get_writer().add(DB.ORDER_COLLECTION, ops, children=requests)
+
+    orders = None  # clear previous values to free up memeory
+    return True
+
+
+def import_orders_by_ids(ids, normalize=False):
+    """
+    Import orders specified by ID in batches of up to 100 per request
+
+    params:
+    ids: list of int - IDs of orders to import
+    normalize: bool - store line items and refunds in their own collections
+    """
+    ids = sorted(set(ids))
+    num_of_batches = -(-len(ids) // max_order_per_page)
+    print(f"Total batches: {num_of_batches}\n")
+
+    if normalize:
+        ensure_normalized_indexes()
+
+    tasks = (
+        partial(get_orders_by_ids, ids[i : i + max_order_per_page], normalize)
+        for i in range(0, len(ids), max_order_per_page)
+    )
+
+    # use multi-threading to pull multiple batches concurrently, submitting
+    # batches only as workers free up
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
+        for future in tqdm(
+            bounded_as_completed(executor, tasks, 2 * MAX_THREADS),
+            total=num_of_batches,
+            unit="page",
+        ):
+            try:
+                status = future.result()
+            except:
+                pass
+
+    # write what is left in the bulk write buffers
+    get_writer().flush()
+
+    print(f'\n\n{"-" * 50}')
+    print(f"Sink profile: {describe_sink_profile()}")
+    failed = get_writer().failed_records(DB.ORDER_COLLECTION)
+    print(f"Newly inserted records: {num_of_written_records - failed}")
+    print(f"Skipped records: {num_of_skipped_records}")
+    print(f"Failed writes: {failed}")
+    print(f"Peak memory: {peak_memory()}\n")
+
+
+def process_order(order, normalize=False):
     """
     Process order to convert date and times to datetime objects
-    and insert to MongoDB database
+
+    returns: write requests to insert the order to MongoDB database,
+    None when the order is skipped
     """
     global num_of_skipped_records, num_of_written_records
 
@@ -147,18 +258,16 @@ def process_order(order):
 
     order_id = order.get("id")
     if order_id not in orders_in_db:
-        db[DB.ORDER_COLLECTION].find_one_and_replace(
-            filter={"id": order_id}, replacement=order, upsert=True
-        )
         num_of_written_records += 1
+        return order_write_requests(order, normalize)
     else:
         # print(f"Order id: {order_id} found in DB (skipping)")
         num_of_skipped_records += 1
 
 
-def get_order(id):
+def get_order(id, normalize=False):
     """Get specific order specified by ID."""
-    order = wcapi.get(f"orders/{id}").json()
+    order = get_wcapi().get(f"orders/{id}").json()
     if not order.get("id", None):
         print("No order id skipping")
         return
@@ -181,6 +290,62 @@ def get_order(id):
             continue
         order[field] = dateparser.isoparse(str_date)
 
-    db[DB.ORDER_COLLECTION].find_one_and_replace(
-        filter={"id": order.get("id")}, replacement=order, upsert=True
+    if normalize:
+        ensure_normalized_indexes()
+    write_requests(order_write_requests(order, normalize))
+
+
+def ensure_normalized_indexes():
+    """Create the indexes used to link orders with their sub orders and child records."""
+    get_db()[DB.ORDER_COLLECTION].create_index("parent_id")
+    get_db()[DB.LINE_ITEM_COLLECTION].create_index(
+        [("order_id", 1), ("id", 1)], unique=True
+    )
+    get_db()[DB.REFUND_COLLECTION].create_index(
+        [("order_id", 1), ("id", 1)], unique=True
     )
+
+
+def order_write_requests(order, normalize=False):
+    """
+    Build the bulk write requests that insert or replace order in MongoDB database
+
+    When normalize is set, line items and refunds are moved out of the
+    order into their own collections keyed by order id.
+
+    returns: dict of collection name to list of write requests
+    """
+    order_id = order.get("id")
+    if not normalize:
+        return {DB.ORDER_COLLECTION: [ReplaceOne({"id": order_id}, order, upsert=True)]}
+
+    children = {
+        DB.LINE_ITEM_COLLECTION: order.pop("line_items", None) or [],
+        DB.REFUND_COLLECTION: order.pop("refunds", None) or [],
+    }
+    requests = {DB.ORDER_COLLECTION: [ReplaceOne({"id": order_id}, order, upsert=True)]}
+
+    for collection, records in children.items():
+        # remove records that no longer belong to the order, then upsert the rest
+        requests[collection] = [
+            DeleteMany(
+                {"order_id": order_id, "id": {"$nin": [r.get("id") for r in records]}}
+            )
+        ]
+        for record in records:
+            record["order_id"] = order_id
+            record["parent_id"] = order.get("parent_id")
+            record["date_created"] = order.get("date_created")
+            requests[collection].append(
+                ReplaceOne(
+                    {"order_id": order_id, "id": record.get("id")}, record, upsert=True
+                )
+            )
+    return requests
+
+
+def write_requests(requests):
+    """Execute the write requests of each collection as one bulk write."""
+    for collection, ops in requests.items():
+        if ops:
+            get_db()[collection].bulk_write(ops, ordered=False)
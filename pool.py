@@ -0,0 +1,57 @@
+"""
+Helpers to run page tasks on a thread pool with bounded memory
+"""
+import concurrent.futures
+import sys
+
+
+def bounded_as_completed(executor, tasks, max_pending, queue=None):
+    """
+    Submit tasks to executor lazily keeping at most max_pending in flight
+
+    params:
+    executor: concurrent.futures.Executor - pool to run the tasks on
+    tasks: iterable of callables - consumed only as slots free up
+    max_pending: int - maximum number of submitted but unfinished tasks
+    queue: collections.deque of callables - follow-up tasks that running tasks
+    can append to, submitted before the remaining ones from `tasks`
+
+    yields: futures as they complete, holding no reference to them afterwards
+    """
+    tasks = iter(tasks)
+    exhausted = False
+    pending = set()
+    while True:
+        while len(pending) < max_pending:
+            if queue:
+                task = queue.popleft()
+            elif not exhausted:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    continue
+            else:
+                break
+            pending.add(executor.submit(task))
+
+        if not pending:
+            return
+
+        done, pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        yield from done
+        done = None
+
+
+def peak_memory():
+    """Get the peak resident memory of the process formatted in MB."""
+    try:
+        import resource
+    except ImportError:
+        return "n/a"  # resource module is not available on Windows
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak = peak / 1024  # bytes on macOS, kilobytes on Linux
+    return f"{peak / 1024:.1f} MB"
@@ -2,20 +2,29 @@
 Module to import all products or specific product from WooCommerce
 """
 import concurrent.futures
+from collections import deque
+from functools import partial
 from datetime import datetime
+from pymongo import ReplaceOne
 from tqdm import tqdm
 from dateutil import parser as dateparser
 from config import DB, APP
-from connections import wcapi, db
+from connections import get_wcapi, get_db, get_writer, describe_sink_profile
+from idindex import IdIndex
+from pool import bounded_as_completed, peak_memory
 
 MAX_THREADS = APP.MAX_THREADS
 max_product_per_page = 100
 
-# list of products ids that are in the database currently
-products_in_db = set()
+# ids of products that are in the database currently
+products_in_db = IdIndex()
+
+# variation page fetches queued while product pages are processed
+variation_tasks = deque()
 
 num_of_written_records = 0
 num_of_skipped_records = 0
+num_of_variation_records = 0
 
 
 def get_products_in_db(from_date, to_date):
@@ -23,13 +32,18 @@ def get_products_in_db(from_date, to_date):
     # Mongo friendly datetime
     from_date = dateparser.isoparse(from_date)
     to_date = dateparser.isoparse(to_date)
-    results = db[DB.PRODUCT_COLLECTION].find(
+    collection = get_db()[DB.PRODUCT_COLLECTION]
+    # index on id lets the sort below (and upserts by id) avoid an in-memory sort
+    collection.create_index("id")
+    results = collection.find(
         {"date_created": {"$gte": from_date, "$lte": to_date}},
+        projection={"id": 1, "_id": 0},
+        sort=[("id", 1)],
     )
     return results
 
 
-def import_all_products(sort, from_date, to_date, sync=False):
+def import_all_products(sort, from_date, to_date, sync=False, with_variations=False):
     """
     Import all products between from_date and to_date
 
@@ -37,6 +51,7 @@ def import_all_products(sort, from_date, to_date, sync=False):
     sort: str - Sort products ascending or descending.
     from_date: str - import products submitted starting from this date
     to_date: str - import products submitted untill this date
+    with_variations: bool - also import variations of variable products
 
     returns: list of products
     """
@@ -45,8 +60,7 @@ def import_all_products(sort, from_date, to_date, sync=False):
     if sync == True:
         # get all products that are in the database first
         results = get_products_in_db(from_date, to_date)
-        for product in results:
-            products_in_db.add(product.get("id"))
+        products_in_db.load(product.get("id") for product in results)
 
     print("Products found in DB: ", len(products_in_db))
 
@@ -54,7 +68,7 @@ def import_all_products(sort, from_date, to_date, sync=False):
     before = datetime.fromisoformat(to_date)
 
     page = 1
-    initial_products = wcapi.get(
+    initial_products = get_wcapi().get(
         "products",
         params={
             "per_page": max_product_per_page,
@@ -66,17 +80,34 @@ def import_all_products(sort, from_date, to_date, sync=False):
     )
     total_pages = initial_products.headers.get("X-WP-TotalPages", 0)
     print(f"Total pages: {total_pages}\n")
-    pages = range(1, int(total_pages) + 1)
+    pages = range(2, int(total_pages) + 1)
+
+    def tasks():
+        if int(total_pages) > 0:
+            # page 1 is already fetched, process its body instead of requesting it again
+            yield partial(
+                get_products,
+                1,
+                sort,
+                after,
+                before,
+                with_variations=with_variations,
+                response=initial_products,
+            )
+        for page in pages:
+            yield partial(
+                get_products, page, sort, after, before, with_variations=with_variations
+            )
 
-    # use multi-threading to pull multiple products concurrently
+    # use multi-threading to pull multiple products concurrently, submitting pages
+    # only as workers free up so memory stays flat regardless of the number of pages.
+    # variation pages queued by processed product pages share the same workers
     with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        future_to_product = {
-            executor.submit(get_products, page, sort, after, before): page
-            for page in pages
-        }
         for future in tqdm(
-            concurrent.futures.as_completed(future_to_product),
-            total=int(total_pages),
+            bounded_as_completed(
+                executor, tasks(), 2 * MAX_THREADS, queue=variation_tasks
+            ),
+            total=None if with_variations else int(total_pages),
             unit="page",
         ):
             try:
@@ -84,42 +115,226 @@ def import_all_products(sort, from_date, to_date, sync=False):
             except:
                 pass
 
+    # write what is left in the bulk write buffers
+    get_writer().flush()
+
     print(f'\n\n{"-" * 50}')
-    print(f"Newly inserted records: {num_of_written_records}")
-    print(f"Skipped records: {num_of_skipped_records}\n")
+    print(f"Sink profile: {describe_sink_profile()}")
+    failed = get_writer().failed_records(DB.PRODUCT_COLLECTION)
+    print(f"Newly inserted records: {num_of_written_records - failed}")
+    print(f"Skipped records: {num_of_skipped_records}")
+    print(f"Failed writes: {failed}")
+    if with_variations:
+        failed_variations = get_writer().failed_records(DB.VARIATION_COLLECTION)
+        print(f"Variation records: {num_of_variation_records - failed_variations}")
+    print(f"Peak memory: {peak_memory()}\n")
+
+
+def get_products(page, sort, after, before, with_variations=False, response=None):
+    """
+    Get products on a specific page.
+
+    An already fetched `response` for the page can be passed to
+    process it without requesting the page again.
+    """
+    try:
+        if response is None:
+            response = get_wcapi().get(
+                "products",
+                params={
+                    "per_page": max_product_per_page,
+                    "after": after.isoformat(),
+                    "before": before.isoformat(),
+                    "page": page,
+                    "order": sort,
+                },
+            )
+        return process_products_page(response, page, with_variations)
+    except Exception as e:
+        print(f"Unexpected Error: {e}")
+    return False
 
 
-def get_products(page, sort, after, before):
-    """Get products on a specific page."""
+def get_products_by_ids(ids, with_variations=False):
+    """Get a batch of products specified by ID with a single request."""
     try:
-        response = wcapi.get(
+        response = get_wcapi().get(
             "products",
             params={
+                "include": ",".join(str(id) for id in ids),
                 "per_page": max_product_per_page,
-                "after": after.isoformat(),
-                "before": before.isoformat(),
-                "page": page,
-                "order": sort,
             },
         )
+        return process_products_page(
+            response, f"with ids {ids[0]}-{ids[-1]}", with_variations
+        )
+    except Exception as e:
+        print(f"Unexpected Error: {e}")
+    return False
+
+
+def process_products_page(response, page, with_variations=False):
+    """
+    Process products on a page response and bulk write them to MongoDB database.
+
+    With with_variations set, fetching the variations of every variable
+    product on the page is queued in `variation_tasks`, including products
+    skipped because they are already in the database.
+    """
+    if response.status_code != 200:
+        print(f"Error status code {response.status_code} for page {page}")
+        return False
+
+    products = tuple(response.json())
+    for product in products:
+        request = process_product(product)
+        if request:
+            get_writer().add(DB.PRODUCT_COLLECTION, [request])
+        if with_variations and product.get("id") and product.get("type") == "variable":
+            variation_tasks.append(partial(get_variations, product["id"], 1))
+
+    products = None  # clear previous values to free up memeory
+    return True
+
+
+def get_variations(product_id, page):
+    """
+    Get variations of a variable product on a specific page.
+
+    Fetching the remaining pages is queued when processing the first one.
+    """
+    try:
+        response = get_wcapi().get(
+            f"products/{product_id}/variations",
+            params={"per_page": max_product_per_page, "page": page},
+        )
         if response.status_code != 200:
-            print(f"Error status code {response.status_code} for page {page}")
-        else:
-            products = tuple(response.json())
-            for product in products:
-                process_product(product)
-
-            products = None  # clear previous values to free up memeory
-            return True
+            print(
+                f"Error status code {response.status_code} for variations page {page}"
+                f" of product {product_id}"
+            )
+            return False
+
+        if page == 1:
+            total_pages = int(response.headers.get("X-WP-TotalPages", 0))
+            for next_page in range(2, total_pages + 1):
+                variation_tasks.append(partial(get_variations, product_id, next_page))
+
+        variations = tuple(response.json())
+        for variation in variations:
+            request = process_variation(variation, product_id)
+            if request:
+                get_writer().add(DB.VARIATION_COLLECTION, [request])
+
+        variations = None  # clear previous values to free up memory
+        return True
     except Exception as e:
         print(f"Unexpected Error: {e}")
     return False
 
 
+def process_variation(variation, product_id):
+    """
+    Process variation to convert date and times to datetime objects
+
+    returns: write request to insert the variation to MongoDB database
+    """
+    global num_of_variation_records
+
+    if not variation.get("id", None):
+        print("No variation id skipping")
+        return
+
+    date_fields = [
+        "date_created",
+        "date_created_gmt",
+        "date_modified",
+        "date_modified_gmt",
+        "date_on_sale_from",
+        "date_on_sale_from_gmt",
+        "date_on_sale_to",
+        "date_on_sale_to_gmt",
+    ]
+    image_date_fields = date_fields[:4]
+    for field in date_fields:
+        if field not in variation:
+            continue
+        str_date = variation[field]
+        if not str_date:
+            continue
+        variation[field] = dateparser.isoparse(str_date)
+
+    image = variation.get("image") or {}
+    for field in image_date_fields:
+        if field not in image:
+            continue
+        str_date = image[field]
+        if not str_date:
+            continue
+        image[field] = dateparser.isoparse(str_date)
+
+    variation["product_id"] = product_id
+    num_of_variation_records += 1
+    return ReplaceOne({"id": variation["id"]}, variation, upsert=True)
+
+
+def import_products_by_ids(ids, with_variations=False):
+    """
+    Import products specified by ID in batches of up to 100 per request
+
+    params:
+    ids: list of int - IDs of products to import
+    with_variations: bool - also import variations of variable products
+    """
+    ids = sorted(set(ids))
+    num_of_batches = -(-len(ids) // max_product_per_page)
+    print(f"Total batches: {num_of_batches}\n")
+
+    tasks = (
+        partial(
+            get_products_by_ids,
+            ids[i : i + max_product_per_page],
+            with_variations=with_variations,
+        )
+        for i in range(0, len(ids), max_product_per_page)
+    )
+
+    # use multi-threading to pull multiple batches concurrently,
+    # variation pages queued by processed batches share the same workers
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
+        for future in tqdm(
+            bounded_as_completed(
+                executor, tasks, 2 * MAX_THREADS, queue=variation_tasks
+            ),
+            total=None if with_variations else num_of_batches,
+            unit="page",
+        ):
+            try:
+                status = future.result()
+            except:
+                pass
+
+    # write what is left in the bulk write buffers
+    get_writer().flush()
+
+    print(f'\n\n{"-" * 50}')
+    print(f"Sink profile: {describe_sink_profile()}")
+    failed = get_writer().failed_records(DB.PRODUCT_COLLECTION)
+    print(f"Newly inserted records: {num_of_written_records - failed}")
+    print(f"Skipped records: {num_of_skipped_records}")
+    print(f"Failed writes: {failed}")
+    if with_variations:
+        failed_variations = get_writer().failed_records(DB.VARIATION_COLLECTION)
+        print(f"Variation records: {num_of_variation_records - failed_variations}")
+    print(f"Peak memory: {peak_memory()}\n")
+
+
 def process_product(product):
     """
     Process product to convert date and times to datetime objects
-    and insert to MongoDB database
+
+    returns: write request to insert the product to MongoDB database,
+    None when the product is skipped
     """
     global num_of_skipped_records, num_of_written_records
 
@@ -157,10 +372,8 @@ def process_product(product):
 
     product_id = product.get("id")
     if product_id not in products_in_db:
-        db[DB.PRODUCT_COLLECTION].find_one_and_replace(
-            filter={"id": product_id}, replacement=product, upsert=True
-        )
         num_of_written_records += 1
+        return ReplaceOne({"id": product_id}, product, upsert=True)
     else:
         # print(f"Product id: {product_id} found in DB (skipping)")
         num_of_skipped_records += 1
@@ -168,7 +381,7 @@ def process_product(product):
 
 def get_product(id):
     """Get specific product specified by ID."""
-    product = wcapi.get(f"products/{id}").json()
+    product = get_wcapi().get(f"products/{id}").json()
     if not product.get("id", None):
         print("No product id skipping")
         return
@@ -201,6 +414,6 @@ def get_product(id):
                 continue
             product["images"][i][field] = dateparser.isoparse(str_date)
 
-    db[DB.PRODUCT_COLLECTION].find_one_and_replace(
+    get_db()[DB.PRODUCT_COLLECTION].find_one_and_replace(
         filter={"id": product.get("id")}, replacement=product, upsert=True
     )
@@ -0,0 +1,99 @@
+"""
+Token-bucket rate limiting for WooCommerce API requests
+"""
+import json
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket allowing `rate` requests per minute with bursts of up to `capacity`.
+
+    When `state_file` is given, the bucket state is kept in that file under
+    `name` and guarded with a file lock, so concurrent processes (e.g. cron
+    jobs) share one budget. Otherwise the bucket is shared by the threads
+    of the current process only.
+    """
+
+    def __init__(self, name, rate, capacity, state_file=None):
+        self.name = name
+        self.rate = rate / 60  # tokens per second
+        self.capacity = max(capacity, 1)
+        self.state_file = state_file
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            wait = self._take()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _take(self):
+        """Take a token if available, otherwise return seconds to wait for one."""
+        with self._lock:
+            if not self.state_file:
+                self._tokens, self._updated, wait = self._refill_and_take(
+                    self._tokens, self._updated
+                )
+                return wait
+
+            import fcntl
+
+            with open(self.state_file, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    state = json.loads(content) if content else {}
+                    tokens, updated = state.get(self.name, (self.capacity, time.time()))
+                    tokens, updated, wait = self._refill_and_take(tokens, updated)
+                    state[self.name] = (tokens, updated)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                    os.fsync(f.fileno())
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            return wait
+
+    def _refill_and_take(self, tokens, updated):
+        """
+        Add the tokens earned since `updated` and take one if possible
+
+        returns: tuple of (tokens, updated, seconds to wait)
+        """
+        now = time.time()
+        tokens = min(self.capacity, tokens + max(now - updated, 0) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, now, 0
+        return tokens, now, (1 - tokens) / self.rate
+
+
+class RateLimitedAPI:
+    """
+    WooCommerce API client wrapper that takes a token before each request.
+
+    Single record endpoints (e.g. orders/123) use `item_bucket`, list
+    endpoints (e.g. orders) use `list_bucket`. A bucket of None is unlimited.
+    """
+
+    def __init__(self, api, list_bucket=None, item_bucket=None):
+        self.api = api
+        self.list_bucket = list_bucket
+        self.item_bucket = item_bucket
+
+    def get(self, endpoint, **kwargs):
+        if endpoint.rstrip("/").rsplit("/", 1)[-1].isdigit():
+            bucket = self.item_bucket
+        else:
+            bucket = self.list_bucket
+        if bucket:
+            bucket.acquire()
+        return self.api.get(endpoint, **kwargs)
@@ -0,0 +1,129 @@
+"""
+Buffered bulk writes to MongoDB database
+"""
+import threading
+from pymongo.errors import BulkWriteError, PyMongoError
+
+
+class BulkWriter:
+    """
+    Collects the write requests of records from all worker threads and
+    writes them with one bulk_write per collection once `batch_size`
+    requests are buffered.
+
+    A record's requests in child collections (e.g. order line items) are
+    always written in the same flush as the record, before it. The record
+    itself is only written when all of its child requests succeeded, so a
+    record is never stored without its children.
+
+    Call `flush` at the end of an import to write the remaining requests.
+    Write errors don't raise, the records that were not written are
+    counted per collection for the run summary.
+    """
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.batch_size = max(batch_size, 1)
+        self._records = []
+        self._num_of_requests = 0
+        self._failed = {}
+        self._lock = threading.Lock()
+
+    def add(self, collection, requests, children=None):
+        """
+        Buffer the write requests of one record, writing all buffered
+        records when the batch is full.
+
+        params:
+        collection: str - collection of the record
+        requests: list - write requests of the record in collection
+        children: dict - collection name to write requests of the record's children
+        """
+        children = children or {}
+        records = None
+        with self._lock:
+            self._records.append((collection, requests, children))
+            self._num_of_requests += len(requests) + sum(
+                len(ops) for ops in children.values()
+            )
+            if self._num_of_requests >= self.batch_size:
+                records = self._records
+                self._records = []
+                self._num_of_requests = 0
+
+        # write outside the lock so other threads keep buffering meanwhile
+        if records:
+            self._write(records)
+
+    def flush(self):
+        """Write all buffered requests."""
+        with self._lock:
+            records = self._records
+            self._records = []
+            self._num_of_requests = 0
+
+        if records:
+            self._write(records)
+
+    def failed_records(self, collection):
+        """Get the number of records of collection that failed to be written."""
+        with self._lock:
+            return self._failed.get(collection, 0)
+
+    def _write(self, records):
+        """Write the children of the records first, then the records themselves."""
+        children = {}
+        for i, (_, _, record_children) in enumerate(records):
+            for collection, ops in record_children.items():
+                batch = children.setdefault(collection, ([], []))
+                batch[0].extend(ops)
+                batch[1].extend([i] * len(ops))
+
+        failed = set()
+        for collection, (ops, owners) in children.items():
+            failed |= self._bulk_write(collection, ops, owners)
+
+        parents = {}
+        for i, (collection, ops, _) in enumerate(records):
+            if i in failed:
+                continue  # written on a later run instead of without its children
+            batch = parents.setdefault(collection, ([], []))
+            batch[0].extend(ops)
+            batch[1].extend([i] * len(ops))
+
+        for collection, (ops, owners) in parents.items():
+            failed |= self._bulk_write(collection, ops, owners)
+
+        if failed:
+            with self._lock:
+                for i in failed:
+                    collection = records[i][0]
+                    self._failed[collection] = self._failed.get(collection, 0) + 1
+
+    def _bulk_write(self, collection, ops, owners):
+        """
+        Bulk write ops to collection
+
+        returns: set of indexes of the records whose requests failed
+        """
+        if not ops:
+            return set()
+        try:
+            self.db[collection].bulk_write(ops, ordered=False)
+            return set()
+        except BulkWriteError as e:
+            # unordered bulk writes still apply the requests without errors
+            write_errors = e.details.get("writeErrors") or []
+            failed = {owners[error["index"]] for error in write_errors}
+            num_of_failed = len(write_errors)
+            error = write_errors[0].get("errmsg") if write_errors else e
+        except PyMongoError as e:
+            failed = set(owners)
+            num_of_failed = len(ops)
+            error = e
+
+        print(
+            f"Failed to write {num_of_failed} of {len(ops)} requests "
+            f"to {collection}: {error}"
+        )
+        return failed
@@ -0,0 +1,227 @@
+"""
+Module to verify records in MongoDB database against WooCommerce
+and re-import only the missing or stale ones
+"""
+import concurrent.futures
+from datetime import datetime, timedelta
+from dateutil import parser as dateparser
+from config import DB, APP
+from connections import get_wcapi, get_db
+
+MAX_THREADS = APP.MAX_THREADS
+max_record_per_page = 100
+
+# buckets with at most this many records are compared id by id instead of split further
+max_leaf_records = 500
+
+# entities that can be filtered by creation date in WooCommerce, with their collections
+collections = {
+    "orders": DB.ORDER_COLLECTION,
+    "products": DB.PRODUCT_COLLECTION,
+}
+
+
+def store_bounds(start, end):
+    """
+    Get WooCommerce after/before params matching the [start, end) bucket
+
+    WooCommerce passes after/before to a WP date query whose bounds are
+    exclusive, while buckets in the database are counted with
+    $gte start and $lt end. Moving `after` one second back makes the store
+    include records created exactly on the start second (dates have
+    whole second precision), so both sides count the same interval.
+    """
+    return {
+        "after": (start - timedelta(seconds=1)).isoformat(),
+        "before": end.isoformat(),
+    }
+
+
+def count_in_store(entity, start, end):
+    """Get the number of records created in the bucket from X-WP-Total."""
+    response = get_wcapi().get(
+        entity,
+        params={
+            "per_page": 1,
+            **store_bounds(start, end),
+            "_fields": "id",
+        },
+    )
+    if response.status_code != 200:
+        raise Exception(f"Error status code {response.status_code} counting {entity}")
+    return int(response.headers.get("X-WP-Total", 0))
+
+
+def count_in_db(entity, start, end):
+    """Get the number of records created in the bucket in the database."""
+    return get_db()[collections[entity]].count_documents(
+        {"date_created": {"$gte": start, "$lt": end}}
+    )
+
+
+def check_bucket(entity, start, end):
+    """
+    Compare record counts of a bucket in WooCommerce and the database
+
+    returns: tuple of (start, end, count in store, count in database)
+    """
+    return (
+        start,
+        end,
+        count_in_store(entity, start, end),
+        count_in_db(entity, start, end),
+    )
+
+
+def split_bucket(start, end, parts):
+    """Split the datetime range into `parts` buckets of whole seconds."""
+    step = max((end - start) / parts, timedelta(seconds=1))
+    buckets = []
+    bucket_start = start
+    while bucket_start < end:
+        bucket_end = min((bucket_start + step).replace(microsecond=0), end)
+        if bucket_end <= bucket_start:
+            bucket_end = min(bucket_start + timedelta(seconds=1), end)
+        buckets.append((bucket_start, bucket_end))
+        bucket_start = bucket_end
+    return buckets
+
+
+def compare_bucket(entity, start, end):
+    """
+    Compare a bucket id by id using the modification dates as checksum
+
+    returns: tuple of (missing or stale ids, ids only in the database)
+    """
+    in_store = {}
+    page = 1
+    while True:
+        response = get_wcapi().get(
+            entity,
+            params={
+                "per_page": max_record_per_page,
+                **store_bounds(start, end),
+                "page": page,
+                "_fields": "id,date_modified",
+            },
+        )
+        if response.status_code != 200:
+            raise Exception(f"Error status code {response.status_code} for page {page}")
+        for record in response.json():
+            date_modified = record.get("date_modified")
+            if date_modified:
+                date_modified = dateparser.isoparse(date_modified)
+            in_store[record["id"]] = date_modified
+        if page >= int(response.headers.get("X-WP-TotalPages", 0)):
+            break
+        page += 1
+
+    in_db = {}
+    results = get_db()[collections[entity]].find(
+        {"date_created": {"$gte": start, "$lt": end}},
+        projection={"id": 1, "date_modified": 1, "_id": 0},
+    )
+    for record in results:
+        in_db[record.get("id")] = record.get("date_modified")
+
+    outdated = []
+    for id, date_modified in in_store.items():
+        if id not in in_db:
+            outdated.append(id)
+        elif date_modified and in_db[id] != date_modified:
+            outdated.append(id)
+    extra = [id for id in in_db if id not in in_store]
+    return outdated, extra
+
+
+def verify(entity, from_date, to_date, buckets=24, reimport=True, normalize=False):
+    """
+    Verify records created between from_date and to_date
+
+    The range is split into buckets whose counts are compared between
+    WooCommerce and the database. Mismatching buckets are split again
+    until they are small enough to be compared id by id.
+
+    params:
+    entity: str - orders or products
+    from_date: str - verify records created starting from this date
+    to_date: str - verify records created untill this date
+    buckets: int - number of buckets to split the range into on each level
+    reimport: bool - re-import missing and stale records
+    normalize: bool - re-import orders in normalized mode (orders --normalize)
+
+    returns: list of missing or stale ids
+    """
+    start = datetime.fromisoformat(from_date)
+    end = datetime.fromisoformat(to_date)
+
+    # every bucket counts and finds records by date_created
+    get_db()[collections[entity]].create_index("date_created")
+
+    pending = split_bucket(start, end, buckets)
+    leaves = []
+    unverified = []
+    num_of_buckets = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
+        while pending:
+            future_to_bucket = {
+                executor.submit(check_bucket, entity, *bucket): bucket
+                for bucket in pending
+            }
+            num_of_buckets += len(future_to_bucket)
+            pending = []
+            for future in concurrent.futures.as_completed(future_to_bucket):
+                try:
+                    bucket_start, bucket_end, store_total, db_total = future.result()
+                except Exception as e:
+                    bucket = future_to_bucket[future]
+                    print(f"Unverified {bucket[0]} - {bucket[1]}: {e}")
+                    unverified.append(bucket)
+                    continue
+                if store_total == db_total:
+                    continue
+                print(
+                    f"Mismatch {bucket_start} - {bucket_end}: "
+                    f"{store_total} in store, {db_total} in DB"
+                )
+                too_short = bucket_end - bucket_start <= timedelta(seconds=1)
+                if too_short or max(store_total, db_total) <= max_leaf_records:
+                    leaves.append((bucket_start, bucket_end))
+                else:
+                    pending.extend(split_bucket(bucket_start, bucket_end, 2))
+
+        outdated = []
+        extra = []
+        future_to_bucket = {
+            executor.submit(compare_bucket, entity, *bucket): bucket
+            for bucket in leaves
+        }
+        for future in concurrent.futures.as_completed(future_to_bucket):
+            try:
+                bucket_outdated, bucket_extra = future.result()
+            except Exception as e:
+                bucket = future_to_bucket[future]
+                print(f"Unverified {bucket[0]} - {bucket[1]}: {e}")
+                unverified.append(bucket)
+                continue
+            outdated.extend(bucket_outdated)
+            extra.extend(bucket_extra)
+
+    print(f'\n{"-" * 50}')
+    print(f"Buckets checked: {num_of_buckets}")
+    print(f"Missing or stale records: {len(outdated)}")
+    print(f"Records only in DB: {len(extra)}")
+    print(f"Unverified buckets: {len(unverified)}\n")
+
+    if outdated and reimport:
+        if entity == "orders":
+            import orders
+
+            orders.import_orders_by_ids(outdated, normalize=normalize)
+        else:
+            import products
+
+            products.import_products_by_ids(outdated)
+
+    return outdated